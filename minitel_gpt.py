@@ -11,16 +11,53 @@ Usage:
 
 Dépendances:
     pip install pyserial openai
+    pip install orjson  # optionnel, accélère la lecture/écriture JSON
+    pip install numba   # optionnel, wrap compilé pour les longues réponses
 """
 
 import argparse
+import atexit
+import codecs
+import functools
 import json
+import logging
 import os
+import queue
+import re
 import sys
+import threading
 import time
-import textwrap
+from enum import IntEnum
 from pathlib import Path
-from typing import Optional, Generator, List, Dict, Any
+from typing import Optional, Generator, Iterator, List, Dict, Tuple, Any
+
+# orjson (optionnel): sérialisation JSON en C, repli sur json sinon
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+
+    def _dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj) + b"\n"
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+
+    def _dumps_line(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+
+    _loads = json.loads
+
+# numba + numpy (optionnels): noyau de wrap compilé pour les longues réponses
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
 
 # --- Configuration par défaut ---
 DEFAULT_MODEL = "gpt-4o-mini"
@@ -30,6 +67,8 @@ LINE_DELAY_MS = 80
 CHAR_DELAY_MS = 0  # 0 = désactivé
 MAX_HISTORY_TURNS = 20
 MAX_HISTORY_CHARS = 16000
+SAVE_INTERVAL = 2.0  # secondes minimum entre deux history.save() pendant le shell
+JIT_WRAP_MIN_CHARS = 4000  # en dessous, wrap_40 reste plus rapide que l'appel numba
 
 # Clé API en dur (laisser vide pour utiliser OPENAI_API_KEY)
 # ATTENTION: Ne pas committer avec une vraie clé si repo public!
@@ -37,7 +76,7 @@ HARDCODED_API_KEY = ""
 
 # Fichiers de configuration/données
 CONFIG_FILE = "minitel_config.json"
-HISTORY_FILE = "history.json"
+HISTORY_FILE = "history.jsonl"
 SYSTEM_PROFILE_FILE = "system_profile.txt"
 
 # Profil système par défaut si system_profile.txt absent
@@ -46,6 +85,17 @@ Réponds en français.
 Tes réponses seront affichées sur un Minitel (écran 40 colonnes).
 Sois bref et va à l'essentiel."""
 
+# Taille à partir de laquelle le tampon d'émission est vidé (hold_tx)
+TX_FLUSH_BYTES = 256
+
+# Morceaux reçus d'OpenAI en avance pendant que le Minitel affiche
+STREAM_QUEUE_SIZE = 16
+
+# Auto-configuration: durée d'écoute par configuration et nombre de tours
+AUTOCONFIG_SLICE_S = 0.5
+AUTOCONFIG_ROUNDS = 4
+AUTOCONFIG_CONFIRM_S = 10.0  # attente de la confirmation d'un format détecté
+
 # Configurations série à tester (ordre de priorité)
 SERIAL_CONFIGS = [
     {"baud": 1200, "bytesize": 7, "parity": "E", "stopbits": 1, "label": "1200 7E1"},
@@ -65,32 +115,311 @@ SERIAL_CONFIGS = [
 # Utilitaires
 # ============================================================================
 
+# Caractères typographiques fréquents dans les réponses du modèle, hors latin-1.
+# "…" devient 3 caractères: la table est appliquée avant le wrap, pas seulement
+# à l'encodage, pour que les lignes ne dépassent pas 40 colonnes
+_LATIN1_FIXUP = str.maketrans({
+    0x2018: "'", 0x2019: "'", 0x201C: '"', 0x201D: '"',
+    0x2013: "-", 0x2014: "-", 0x2212: "-", 0x2022: "-",
+    0x2026: "...", 0x00A0: " ", 0x202F: " ",
+})
+
+
+# Ligne de délimitation de bloc de code markdown (```, ```json, ```python...)
+_FENCE_RE = re.compile(r"^```[\w+-]*\s*$")
+
+
+# Fragments de wrap: espaces qui précèdent + mot
+_FRAGMENT_RE = re.compile(r"( *)([^ ]+)")
+
+# Points de coupure possibles pour le wrap incrémental
+_BREAK_RE = re.compile(r"[ \n]")
+
+
 def sanitize_latin1(text: str) -> str:
     """Convertit le texte pour affichage latin-1, remplace les caractères non supportés."""
-    return text.encode("latin-1", errors="replace").decode("latin-1")
+    return _to_latin1_bytes(text).decode("latin-1")
+
+
+def _to_latin1_bytes(text: str) -> bytes:
+    """Encode directement en latin-1 (après substitutions typographiques)."""
+    return text.translate(_LATIN1_FIXUP).encode("latin-1", errors="replace")
+
+
+def _fragments(paragraph: str) -> List[Tuple[str, str]]:
+    """Découpe un paragraphe en fragments (espaces qui précèdent, mot)."""
+    return _FRAGMENT_RE.findall(paragraph)
 
 
 def wrap_40(text: str, width: int = WRAP_COLS) -> List[str]:
-    """Découpe le texte en lignes de max `width` colonnes, évite de couper les mots."""
+    """
+    Découpe le texte en lignes de max `width` colonnes, évite de couper les mots.
+    Wrap "first-fit": chaque fragment (espaces + mot) est ajouté à la ligne
+    courante tant qu'il tient, sinon il ouvre une nouvelle ligne (sans ses
+    espaces). Un mot plus long qu'une ligne est coupé.
+    """
     lines = []
     for paragraph in text.split("\n"):
-        if not paragraph.strip():
-            lines.append("")
+        # Paragraphe qui tient déjà sur une ligne: rien à découper
+        if len(paragraph) <= width:
+            lines.append(paragraph.rstrip(" "))
             continue
-        wrapped = textwrap.wrap(paragraph, width=width, break_long_words=True, break_on_hyphens=True)
-        lines.extend(wrapped if wrapped else [""])
+        parts = []
+        cur_len = 0
+        for sep, word in _fragments(paragraph):
+            if parts and cur_len + len(sep) + len(word) > width:
+                lines.append("".join(parts))
+                parts = []
+                cur_len = 0
+                sep = ""
+            piece = sep + word
+            while not parts and len(piece) > width:
+                lines.append(piece[:width])
+                piece = piece[width:]
+            parts.append(piece)
+            cur_len += len(piece)
+        lines.append("".join(parts))
     return lines
 
 
-def log_debug(msg: str, debug_mode: bool = True):
-    """Affiche un message de debug côté console Mac."""
-    if debug_mode:
-        print(f"[DEBUG] {msg}", file=sys.stderr)
+def _wrap_offsets(buf, width):
+    """
+    Noyau de wrap_40 sur un tableau d'octets latin-1 (compilé par numba).
+    Retourne les bornes [début, fin) de chaque ligne, à plat.
+    """
+    n = len(buf)
+    out = np.empty(2 * (n + 2), dtype=np.int64)
+    k = 0
+    i = 0
+    while True:
+        p_end = i
+        while p_end < n and buf[p_end] != 10:
+            p_end += 1
+        line_start = -1
+        line_end = -1
+        j = i
+        while j < p_end:
+            sep = j
+            while j < p_end and buf[j] == 32:
+                j += 1
+            if j >= p_end:
+                break
+            while j < p_end and buf[j] != 32:
+                j += 1
+            # La ligne est une tranche contiguë: sa longueur est j - line_start
+            if line_start >= 0 and j - line_start > width:
+                out[k] = line_start
+                out[k + 1] = line_end
+                k += 2
+                line_start = -1
+                while buf[sep] == 32:
+                    sep += 1
+            if line_start < 0:
+                while j - sep > width:
+                    out[k] = sep
+                    out[k + 1] = sep + width
+                    k += 2
+                    sep += width
+                line_start = sep
+            line_end = j
+        if line_start < 0:
+            line_start = i
+            line_end = i
+        out[k] = line_start
+        out[k + 1] = line_end
+        k += 2
+        if p_end >= n:
+            break
+        i = p_end + 1
+    return out[:k]
+
+
+_wrap_offsets_jit = njit(cache=True)(_wrap_offsets) if njit is not None else None
+
+
+def wrap_text(text: str, width: int = WRAP_COLS) -> List[str]:
+    """wrap_40, via le noyau numba pour les textes longs quand il est disponible."""
+    if _wrap_offsets_jit is None or len(text) < JIT_WRAP_MIN_CHARS:
+        return wrap_40(text, width)
+    # latin-1 avec remplacement: un octet par caractère, les bornes restent valides
+    buf = np.frombuffer(text.encode("latin-1", errors="replace"), dtype=np.uint8)
+    offsets = _wrap_offsets_jit(buf, width)
+    return [text[offsets[k]:offsets[k + 1]] for k in range(0, len(offsets), 2)]
+
+
+@functools.lru_cache(maxsize=8)
+def _read_text(path: str, mtime_ns: int) -> str:
+    return Path(path).read_text(encoding="utf-8")
+
+
+def load_text_cached(path) -> str:
+    """Lit un fichier texte; la lecture n'est refaite que si son mtime a changé."""
+    path = str(path)
+    return _read_text(path, os.stat(path).st_mtime_ns)
+
+
+logger = logging.getLogger("minitel")
+logger.setLevel(logging.INFO)
+
+
+def set_debug_logging(enabled: bool):
+    """Active/désactive les messages de debug côté console Mac (stderr)."""
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if enabled else logging.INFO)
+
+
+# Représentation des octets pour les traces RX (ASCII imprimable ou "?")
+_BYTE_REPR = [repr(chr(b)) if 32 <= b < 127 else "?" for b in range(256)]
 
 
 def hexdump(data: bytes) -> str:
     """Retourne une représentation hexadécimale des données."""
-    return " ".join(f"{b:02x}" for b in data)
+    return data.hex(sep=" ")
+
+
+def _sse_payloads(event: str) -> Iterator[Dict[str, Any]]:
+    # split("\n") et non splitlines(): U+2028, \x0c... peuvent figurer tels
+    # quels dans une chaîne JSON
+    for line in event.split("\n"):
+        if line.startswith("data:"):
+            payload = line[5:].strip()
+            if payload and payload != "[DONE]":
+                yield json.loads(payload)
+
+
+def sse_split(raw_iter) -> Iterator[Dict[str, Any]]:
+    """
+    Normalise un flux SSE en événements JSON décodés.
+    Les morceaux bruts (str/bytes) peuvent contenir plusieurs événements
+    `data:` ou couper un événement en plein JSON: on bufferise jusqu'à la
+    ligne vide qui termine chaque événement. Les objets déjà décodés par le
+    SDK sont transmis tels quels.
+    """
+    buf = ""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in raw_iter:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if not isinstance(chunk, str):
+            yield chunk
+            continue
+        buf += chunk
+        # Sur le tampon et non sur le morceau: un \r\n peut être coupé en deux
+        if "\r" in buf:
+            buf = buf.replace("\r\n", "\n")
+        while "\n\n" in buf:
+            event, buf = buf.split("\n\n", 1)
+            yield from _sse_payloads(event)
+    # Dernier événement sans ligne vide finale
+    buf += decoder.decode(b"", final=True)
+    yield from _sse_payloads(buf.replace("\r\n", "\n"))
+
+
+# ============================================================================
+# Classe LineWrapper
+# ============================================================================
+
+class LineWrapper:
+    """
+    Wrap incrémental pour le streaming: reçoit le texte par morceaux et
+    produit les lignes de `width` colonnes dès qu'elles sont complètes,
+    identiques à celles de wrap_40 sur le texte complet (indentation et
+    espaces multiples conservés, une ligne par paragraphe même vide).
+    Seule la ligne en cours et le fragment en cours de réception (au plus
+    `width` caractères entre deux morceaux) sont conservés; chaque morceau
+    est parcouru une seule fois avec un curseur, sans recopier la fin du texte.
+    Les lignes de délimitation markdown (```json, ```) sont supprimées.
+    """
+
+    def __init__(self, width: int = WRAP_COLS):
+        self.width = width
+        self.parts: List[str] = []
+        self.cur_len = 0
+        self.pending_sep = 0  # espaces qui précèdent le mot en cours
+        self.pending_word = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        """Ajoute un morceau de texte et retourne les lignes terminées."""
+        out: List[str] = []
+        start = 0  # début du mot en cours dans le morceau
+        # Les points de coupure (espace, \n) sont repérés par la regex, en C,
+        # au lieu d'examiner chaque caractère en Python
+        for match in _BREAK_RE.finditer(chunk):
+            i = match.start()
+            if i > start:
+                self.pending_word += chunk[start:i]
+            start = i + 1
+            if self.pending_word:
+                self._place(out)
+            if chunk[i] == "\n":
+                self._end_paragraph(out)
+            else:
+                self.pending_sep += 1
+        if start < len(chunk):
+            self.pending_word += chunk[start:]
+            if self.pending_sep + len(self.pending_word) > self.width:
+                self._cut_pending(out)
+        return out
+
+    def flush(self) -> List[str]:
+        """Retourne la dernière ligne (paragraphe final) en fin de flux."""
+        out: List[str] = []
+        if self.pending_word:
+            self._place(out)
+        self._end_paragraph(out)
+        return out
+
+    def _emit(self, out: List[str], line: str):
+        if not _FENCE_RE.match(line):
+            out.append(line)
+
+    def _end_paragraph(self, out: List[str]):
+        # Comme wrap_40: les espaces de fin de paragraphe sont abandonnés
+        self._emit(out, "".join(self.parts))
+        self.parts = []
+        self.cur_len = 0
+        self.pending_sep = 0
+
+    def _cut_pending(self, out: List[str]):
+        # Fragment en cours déjà plus long qu'une ligne: il sera coupé de
+        # toute façon, on émet tout de suite les tranches pleines pour que le
+        # tampon reste borné (URL, base64... sans espace)
+        sep = " " * self.pending_sep
+        if self.parts:
+            self._emit(out, "".join(self.parts))
+            self.parts = []
+            self.cur_len = 0
+            sep = ""
+        piece = sep + self.pending_word
+        width = self.width
+        while len(piece) > width:
+            self._emit(out, piece[:width])
+            piece = piece[width:]
+        self.pending_sep = 0
+        self.pending_word = piece
+
+    def _place(self, out: List[str]):
+        # Même first-fit que wrap_40, fragment (espaces + mot) par fragment
+        sep = " " * self.pending_sep
+        word = self.pending_word
+        self.pending_sep = 0
+        self.pending_word = ""
+        width = self.width
+        if self.parts and self.cur_len + len(sep) + len(word) > width:
+            self._emit(out, "".join(self.parts))
+            self.parts = []
+            self.cur_len = 0
+            sep = ""
+        piece = sep + word
+        # Fragment plus long qu'une ligne: coupe forcée
+        while not self.parts and len(piece) > width:
+            self._emit(out, piece[:width])
+            piece = piece[width:]
+        self.parts.append(piece)
+        self.cur_len += len(piece)
 
 
 # ============================================================================
@@ -103,16 +432,23 @@ class ConfigStore:
     def __init__(self, filepath: str = CONFIG_FILE):
         self.filepath = Path(filepath)
         self.data: Dict[str, Any] = {}
+        self._mtime: Optional[int] = None
 
     def exists(self) -> bool:
         return self.filepath.exists()
 
     def load(self) -> Dict[str, Any]:
-        if not self.exists():
+        try:
+            mtime = self.filepath.stat().st_mtime_ns
+        except OSError:
             return {}
+        # Fichier inchangé depuis la dernière lecture: pas de relecture
+        if self.data and mtime == self._mtime:
+            return self.data
         try:
             with open(self.filepath, "r", encoding="utf-8") as f:
-                self.data = json.load(f)
+                self.data = _loads(f.read())
+            self._mtime = mtime
         except (json.JSONDecodeError, IOError) as e:
             print(f"[WARN] Erreur lecture config: {e}", file=sys.stderr)
             self.data = {}
@@ -123,7 +459,8 @@ class ConfigStore:
             self.data = data
         try:
             with open(self.filepath, "w", encoding="utf-8") as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
+                f.write(_dumps(self.data))
+            self._mtime = self.filepath.stat().st_mtime_ns
         except IOError as e:
             print(f"[ERREUR] Impossible de sauvegarder config: {e}", file=sys.stderr)
 
@@ -139,7 +476,12 @@ class ConfigStore:
 # ============================================================================
 
 class HistoryStore:
-    """Gère l'historique local des conversations (history.json)."""
+    """
+    Gère l'historique local des conversations (history.jsonl).
+    Journal en ajout seul: un message par ligne, écrit dès son ajout.
+    Le fichier est réécrit (compacté) au chargement et quand les messages
+    retirés par _trim y deviennent majoritaires.
+    """
 
     def __init__(self, filepath: str = HISTORY_FILE, max_turns: int = MAX_HISTORY_TURNS,
                  max_chars: int = MAX_HISTORY_CHARS):
@@ -147,63 +489,137 @@ class HistoryStore:
         self.max_turns = max_turns
         self.max_chars = max_chars
         self.messages: List[Dict[str, str]] = []
+        self._total_chars = 0
+        self._file_lines = 0
 
     def load(self):
-        if not self.filepath.exists():
-            self.messages = []
-            return
+        self.messages = []
+        self._total_chars = 0
+        self._file_lines = 0
+        legacy_path = self.filepath.with_suffix(".json")
+        file_lines = 0
+        migrated = False
         try:
-            with open(self.filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            if self.filepath.exists():
+                for raw in self.filepath.read_bytes().split(b"\n"):
+                    if not raw.strip():
+                        continue
+                    file_lines += 1
+                    try:
+                        msg = _loads(raw)
+                    except ValueError:
+                        # Dernière ligne tronquée (arrêt brutal), éventuellement
+                        # au milieu d'un caractère UTF-8: ignorée
+                        continue
+                    if isinstance(msg, dict):
+                        self.messages.append(msg)
+            elif legacy_path.exists():
+                # Migration depuis l'ancien history.json (liste JSON)
+                data = _loads(legacy_path.read_bytes())
                 self.messages = data if isinstance(data, list) else []
-        except (json.JSONDecodeError, IOError) as e:
+                migrated = True
+            else:
+                return
+        except (ValueError, IOError) as e:
+            # Fichier laissé tel quel: ne pas le compacter avec une liste vide
             print(f"[WARN] Erreur lecture historique: {e}", file=sys.stderr)
             self.messages = []
+            return
+        self._total_chars = sum(len(m.get("content", "")) for m in self.messages)
+        self._file_lines = file_lines
         self._trim()
+        # Réécrire seulement si des lignes ont été ignorées ou retirées
+        # (ou pour créer history.jsonl lors de la migration)
+        if migrated or self._file_lines != len(self.messages):
+            if self._compact() and migrated:
+                # Sinon l'ancien fichier serait re-migré après /history_reset
+                self._unlink(legacy_path)
 
     def save(self):
+        """Les messages sont déjà écrits par add(); compacte si nécessaire."""
         self._trim()
+        if self._file_lines > 2 * len(self.messages):
+            self._compact()
+
+    def add(self, role: str, content: str):
+        msg = {"role": role, "content": content}
+        self.messages.append(msg)
+        self._total_chars += len(content)
         try:
-            with open(self.filepath, "w", encoding="utf-8") as f:
-                json.dump(self.messages, f, indent=2, ensure_ascii=False)
+            with open(self.filepath, "ab") as f:
+                f.write(_dumps_line(msg))
+            self._file_lines += 1
         except IOError as e:
             print(f"[ERREUR] Impossible de sauvegarder historique: {e}", file=sys.stderr)
-
-    def add(self, role: str, content: str):
-        self.messages.append({"role": role, "content": content})
         self._trim()
 
     def reset(self):
         self.messages = []
-        if self.filepath.exists():
+        self._total_chars = 0
+        self._file_lines = 0
+        self._unlink(self.filepath)
+        # history.json d'avant la migration, s'il n'a pas pu être supprimé
+        self._unlink(self.filepath.with_suffix(".json"))
+
+    @staticmethod
+    def _unlink(path: Path):
+        if path.exists():
             try:
-                self.filepath.unlink()
+                path.unlink()
             except IOError:
                 pass
 
+    def _compact(self) -> bool:
+        """Réécrit le journal avec les seuls messages conservés."""
+        try:
+            with open(self.filepath, "wb") as f:
+                f.write(b"".join(_dumps_line(m) for m in self.messages))
+            self._file_lines = len(self.messages)
+            return True
+        except IOError as e:
+            print(f"[ERREUR] Impossible de sauvegarder historique: {e}", file=sys.stderr)
+            return False
+
     def get_messages(self) -> List[Dict[str, str]]:
         return list(self.messages)
 
     def _trim(self):
         # Limiter par nombre de tours (paires user/assistant)
         while len(self.messages) > self.max_turns * 2:
-            self.messages.pop(0)
-        # Limiter par taille totale
-        total_chars = sum(len(m.get("content", "")) for m in self.messages)
-        while total_chars > self.max_chars and self.messages:
             removed = self.messages.pop(0)
-            total_chars -= len(removed.get("content", ""))
+            self._total_chars -= len(removed.get("content", ""))
+        # Limiter par taille totale (compteur tenu à jour par add/load/reset)
+        while self._total_chars > self.max_chars and self.messages:
+            removed = self.messages.pop(0)
+            self._total_chars -= len(removed.get("content", ""))
 
 
 # ============================================================================
 # Classe OpenAIClientWrapper
 # ============================================================================
 
+class EventType(IntEnum):
+    """Types d'événements normalisés produits par OpenAIClientWrapper.call_events."""
+    TEXT_DELTA = 5
+    FINISH = 9
+    USAGE = 10
+    ERROR = 11
+
+
+class StreamContext:
+    """État d'un appel conservé entre les événements et entre les retries."""
+    __slots__ = ("emitted", "finish_reason", "usage")
+
+    def __init__(self):
+        self.emitted = 0
+        self.finish_reason: Optional[str] = None
+        self.usage: Any = None
+
+
 class OpenAIClientWrapper:
     """Wrapper pour l'API OpenAI avec support streaming et fallback."""
 
-    def __init__(self, api_key: Optional[str] = None, debug: bool = False):
-        self.debug = debug
+    def __init__(self, api_key: Optional[str] = None):
         self.client = None
         self._init_client(api_key)
 
@@ -233,34 +649,56 @@ class OpenAIClientWrapper:
         Appelle l'API OpenAI et retourne un générateur de chunks de texte.
         Si stream=False, retourne le texte complet en un seul chunk.
         """
+        for kind, payload in self.call_events(messages, model, stream):
+            if kind == EventType.TEXT_DELTA:
+                yield payload
+            elif kind == EventType.ERROR:
+                yield f"[Erreur API: {payload}]"
+
+    def call_events(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                    stream: bool = True) -> Iterator[Tuple[EventType, Any]]:
+        """
+        Appelle l'API OpenAI et retourne le flux d'événements normalisés
+        (TEXT_DELTA..., FINISH, USAGE éventuel, ou ERROR).
+        Un retry n'est tenté que si aucun texte n'a encore été émis, pour ne
+        jamais afficher deux fois le début d'une réponse.
+        """
         max_retries = 3
         retry_delay = 2
+        ctx = StreamContext()
 
         for attempt in range(max_retries):
             try:
                 if self._use_new_api:
-                    yield from self._call_new_api(messages, model, stream)
+                    events = self._call_new_api(messages, model, stream, ctx)
                 else:
-                    yield from self._call_legacy_api(messages, model, stream)
+                    events = self._call_legacy_api(messages, model, stream, ctx)
+                for event in events:
+                    ctx.emitted += len(event[1])
+                    yield event
+                # FINISH/USAGE émis après le dernier delta, même si le
+                # fournisseur les a envoyés plus tôt dans le flux
+                yield EventType.FINISH, ctx.finish_reason
+                if ctx.usage is not None:
+                    yield EventType.USAGE, ctx.usage
                 return
             except Exception as e:
                 error_str = str(e).lower()
                 # Erreurs transitoires: retry
-                if any(x in error_str for x in ["rate limit", "timeout", "connection", "503", "502"]):
-                    if attempt < max_retries - 1:
-                        if self.debug:
-                            log_debug(f"Erreur transitoire, retry dans {retry_delay}s: {e}")
+                if any(x in error_str for x in ["rate limit", "timeout", "connection", "overloaded",
+                                                "503", "502", "529"]):
+                    if attempt < max_retries - 1 and not ctx.emitted:
+                        logger.debug("Erreur transitoire, retry dans %ss: %s", retry_delay, e)
                         time.sleep(retry_delay)
                         retry_delay *= 2
                         continue
                 # Erreur fatale ou dernier retry
-                if self.debug:
-                    log_debug(f"Erreur API OpenAI: {e}")
-                yield f"[Erreur API: {type(e).__name__}]"
+                logger.debug("Erreur API OpenAI: %s", e)
+                yield EventType.ERROR, type(e).__name__
                 return
 
     def _call_new_api(self, messages: List[Dict[str, str]], model: str,
-                      stream: bool) -> Generator[str, None, None]:
+                      stream: bool, ctx: StreamContext) -> Iterator[Tuple[EventType, str]]:
         """Appel avec le nouveau SDK OpenAI (>=1.0)."""
         if stream:
             response = self.client.chat.completions.create(
@@ -269,19 +707,28 @@ class OpenAIClientWrapper:
                 stream=True
             )
             for chunk in response:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    ctx.usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    yield EventType.TEXT_DELTA, choice.delta.content
+                if choice.finish_reason:
+                    ctx.finish_reason = choice.finish_reason
         else:
             response = self.client.chat.completions.create(
                 model=model,
                 messages=messages,
                 stream=False
             )
+            ctx.usage = getattr(response, "usage", None)
             if response.choices:
-                yield response.choices[0].message.content or ""
+                ctx.finish_reason = response.choices[0].finish_reason
+                yield EventType.TEXT_DELTA, response.choices[0].message.content or ""
 
     def _call_legacy_api(self, messages: List[Dict[str, str]], model: str,
-                         stream: bool) -> Generator[str, None, None]:
+                         stream: bool, ctx: StreamContext) -> Iterator[Tuple[EventType, str]]:
         """Fallback pour anciennes versions du SDK."""
         if stream:
             response = self.client.ChatCompletion.create(
@@ -289,31 +736,42 @@ class OpenAIClientWrapper:
                 messages=messages,
                 stream=True
             )
-            for chunk in response:
-                delta = chunk.get("choices", [{}])[0].get("delta", {})
-                if "content" in delta:
-                    yield delta["content"]
+            for event in sse_split(response):
+                choices = event.get("choices") or [{}]
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield EventType.TEXT_DELTA, content
+                if choices[0].get("finish_reason"):
+                    ctx.finish_reason = choices[0]["finish_reason"]
         else:
             response = self.client.ChatCompletion.create(
                 model=model,
                 messages=messages,
                 stream=False
             )
-            yield response["choices"][0]["message"]["content"]
+            ctx.usage = response.get("usage")
+            ctx.finish_reason = response["choices"][0].get("finish_reason")
+            yield EventType.TEXT_DELTA, response["choices"][0]["message"]["content"] or ""
 
 
 # ============================================================================
 # Classe SerialMinitel
 # ============================================================================
 
+# Séquence Vidéotex pré-encodée (le Minitel 1 ne comprend pas l'ANSI/VT100)
+_ESC_CLEAR = b"\x0c"
+
+
 class SerialMinitel:
     """Gère la communication série avec le Minitel."""
 
+    # Retours ligne pré-encodés pour fake_clear (tailles usuelles)
+    _CLEAR_BLOBS = {n: b"\r\n" * n for n in (5, PAGE_LINES, 24)}
+
     def __init__(self, port: str, baud: int = 1200, bytesize: int = 7,
                  parity: str = "E", stopbits: int = 1,
                  line_delay_ms: int = LINE_DELAY_MS,
-                 char_delay_ms: int = CHAR_DELAY_MS,
-                 debug: bool = False):
+                 char_delay_ms: int = CHAR_DELAY_MS):
         self.port = port
         self.baud = baud
         self.bytesize = bytesize
@@ -321,9 +779,16 @@ class SerialMinitel:
         self.stopbits = stopbits
         self.line_delay_ms = line_delay_ms
         self.char_delay_ms = char_delay_ms
-        self.debug = debug
         self.serial = None
         self._pagination_enabled = True
+        self._rx_buffer = bytearray()
+        self._tx_buf = bytearray()
+        self._tx_hold = False
+        self._crlf = b"\r\n"
+        # Tampon réutilisé pour construire chaque envoi (writeln, write_many)
+        self._scratch = bytearray()
+        # Durée d'émission d'un caractère sur la ligne (start + données + parité + stop)
+        self._bit_time = (1 + bytesize + (0 if parity == "N" else 1) + stopbits) / baud
 
     def open(self) -> bool:
         try:
@@ -338,13 +803,41 @@ class SerialMinitel:
                 timeout=0.5,
                 write_timeout=2
             )
+            self._enable_low_latency()
             return True
         except Exception as e:
-            if self.debug:
-                log_debug(f"Erreur ouverture port {self.port}: {e}")
+            logger.debug("Erreur ouverture port %s: %s", self.port, e)
             return False
 
+    def _enable_low_latency(self):
+        """
+        Réduit le timer de latence de l'adaptateur USB-série (16 ms par défaut
+        sur FTDI/CH340). Sans effet si la plateforme ne le supporte pas.
+        """
+        if sys.platform == "darwin":
+            # IOSSDATALAT: latence de réception en microsecondes
+            try:
+                import fcntl
+                import struct
+                fcntl.ioctl(self.serial.fileno(), 0x80085400, struct.pack("L", 1000))
+            except Exception as e:
+                logger.debug("IOSSDATALAT non supporté: %s", e)
+            return
+        # Linux: pyserial positionne ASYNC_LOW_LATENCY (timer FTDI à 1 ms);
+        # la méthode n'existe pas sur les autres plateformes
+        try:
+            self.serial.set_low_latency_mode(True)
+        except Exception as e:
+            logger.debug("Mode faible latence non supporté: %s", e)
+
     def close(self):
+        self._rx_buffer.clear()
+        if self.is_open():
+            try:
+                self._tx_buf_flush()
+            except Exception:
+                pass
+        self._tx_buf.clear()
         if self.serial and self.serial.is_open:
             try:
                 self.serial.close()
@@ -362,101 +855,206 @@ class SerialMinitel:
         """Écrit du texte brut sur le Minitel (encodage latin-1)."""
         if not self.is_open():
             return
-        data = sanitize_latin1(text).encode("latin-1", errors="replace")
-        if self.char_delay_ms > 0:
-            for byte in data:
-                self.serial.write(bytes([byte]))
-                time.sleep(self.char_delay_ms / 1000.0)
-        else:
-            self.serial.write(data)
+        self._send(_to_latin1_bytes(text))
+
+    def write_bytes(self, data: bytes):
+        """Écrit des octets déjà encodés (séquences constantes)."""
+        if not self.is_open():
+            return
+        self._send(data)
 
     def writeln(self, line: str = ""):
         """Écrit une ligne puis retour chariot."""
-        self.write(line + "\r\n")
-        if self.line_delay_ms > 0:
-            time.sleep(self.line_delay_ms / 1000.0)
+        if not self.is_open():
+            return
+        scratch = self._scratch
+        scratch.clear()
+        scratch += _to_latin1_bytes(line)
+        scratch += self._crlf
+        self._send(scratch)
+
+    def write_many(self, lines: List[str]):
+        """Écrit plusieurs lignes en un seul envoi (délai de ligne cumulé à la fin)."""
+        if not self.is_open() or not lines:
+            return
+        scratch = self._scratch
+        scratch.clear()
+        for line in lines:
+            scratch += _to_latin1_bytes(line)
+            scratch += self._crlf
+        self._send(scratch)
+
+    def _line_pause(self, lines: int):
+        """
+        Délai de ligne adapté au débit, appelé une fois par envoi effectif
+        (`lines` lignes): on n'attend que le temps nécessaire pour vider les
+        octets encore en file, plafonné à lines * line_delay_ms. Ce délai ne
+        crée pas de blanc sur la ligne: il empêche d'empiler plus de texte que
+        le Minitel ne peut en recevoir (Ctrl+C et pagination restent réactifs).
+        """
+        if self.line_delay_ms <= 0 or lines <= 0:
+            return
+        delay = lines * self.line_delay_ms / 1000.0
+        try:
+            delay = min(delay, self.serial.out_waiting * self._bit_time)
+        except Exception:
+            pass  # out_waiting non disponible: délai fixe
+        if delay > 0:
+            time.sleep(delay)
+
+    def hold_tx(self, enabled: bool):
+        """
+        Active/désactive la mise en tampon des envois. Tant qu'elle est
+        active, les écritures sont regroupées et ne partent que par blocs
+        de TX_FLUSH_BYTES, ou sur flush_tx() / avant toute lecture.
+        Sans effet quand un délai de caractère est réglé.
+        """
+        self._tx_hold = enabled
+        if not enabled:
+            self.flush_tx()
+
+    def flush_tx(self):
+        """Envoie immédiatement le contenu du tampon d'émission."""
+        if self.is_open():
+            self._tx_buf_flush()
+
+    def _tx_buf_flush(self):
+        if self._tx_buf:
+            lines = self._tx_buf.count(self._crlf)
+            try:
+                self.serial.write(self._tx_buf)
+            finally:
+                self._tx_buf.clear()
+            self._line_pause(lines)
+
+    def _send(self, data: bytes):
+        """
+        Envoie des octets déjà encodés, en respectant char_delay_ms. Le délai
+        de ligne est appliqué une fois par envoi effectif (lot ou tampon).
+        """
+        if self._tx_hold and self.char_delay_ms <= 0:
+            self._tx_buf += data
+            if len(self._tx_buf) >= TX_FLUSH_BYTES:
+                self._tx_buf_flush()
+            return
+        self._tx_buf_flush()
+        if self.char_delay_ms <= 0:
+            # L'UART cadence déjà les octets au débit de la ligne: un seul appel
+            self.serial.write(data)
+            self._line_pause(data.count(self._crlf))
+            return
+        # Espacement supplémentaire demandé: envoyer par blocs d'environ 20 ms
+        # plutôt qu'octet par octet (chaque write() pyserial coûte ~1 ms)
+        char_delay = self.char_delay_ms / 1000.0
+        block = max(1, int(0.02 / (self._bit_time + char_delay)))
+        for i in range(0, len(data), block):
+            if i:
+                time.sleep(block * char_delay)
+            self.serial.write(data[i:i + block])
+        self._line_pause(data.count(self._crlf))
 
     def clear(self):
         """Efface l'écran (form feed ou faux clear)."""
+        if not self.is_open():
+            return
         # Essayer form feed
-        self.write("\x0c")
+        self._send(_ESC_CLEAR)
         time.sleep(0.1)
         # Fallback: envoyer des lignes vides
         # (le form feed devrait marcher sur la plupart des Minitel)
 
     def fake_clear(self, lines: int = 24):
-        """Faux clear: envoie beaucoup de retours ligne."""
-        for _ in range(lines):
-            self.writeln()
-
-    def read_byte(self, timeout: float = 0.5) -> Optional[int]:
-        """Lit un octet du Minitel."""
+        """Faux clear: envoie beaucoup de retours ligne (en un seul envoi)."""
         if not self.is_open():
-            return None
+            return
+        self._send(self._CLEAR_BLOBS.get(lines) or b"\r\n" * lines)
+
+    def _fill_rx(self, timeout: float) -> bool:
+        """
+        Vide le buffer du driver dans le tampon RX local.
+        Bloque au plus `timeout` secondes si rien n'est encore arrivé.
+        """
+        self._tx_buf_flush()
         old_timeout = self.serial.timeout
         self.serial.timeout = timeout
         try:
-            data = self.serial.read(1)
-            if data:
-                byte = data[0]
-                if self.debug:
-                    log_debug(f"RX: 0x{byte:02x} ({repr(chr(byte)) if 32 <= byte < 127 else '?'})")
-                return byte
-            return None
+            chunk = self.serial.read(self.serial.in_waiting or 1)
         finally:
             self.serial.timeout = old_timeout
+        if not chunk:
+            return False
+        if logger.isEnabledFor(logging.DEBUG):
+            for byte in chunk:
+                logger.debug("RX: 0x%02x (%s)", byte, _BYTE_REPR[byte])
+        self._rx_buffer += chunk
+        return True
+
+    def read_byte(self, timeout: float = 0.5) -> Optional[int]:
+        """Lit un octet du Minitel."""
+        if not self.is_open():
+            return None
+        if not self._rx_buffer and not self._fill_rx(timeout):
+            return None
+        byte = self._rx_buffer[0]
+        del self._rx_buffer[0]
+        return byte
 
     def read_line(self, timeout: float = 60.0, echo: bool = True) -> Optional[str]:
         """
         Lit une ligne jusqu'à Entrée.
         Gère backspace (0x08 et 0x7f) et différentes formes de retour ligne.
+        Les octets sont lus par paquets puis traités en mémoire.
         """
         if not self.is_open():
             return None
 
         buffer = []
-        start_time = time.time()
+        rx = self._rx_buffer
+        deadline = time.monotonic() + timeout
 
-        while (time.time() - start_time) < timeout:
-            byte = self.read_byte(timeout=0.1)
-            if byte is None:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not rx and not self._fill_rx(min(0.1, remaining)):
                 continue
 
-            # Entrée: \r (0x0d) ou \n (0x0a)
-            if byte in (0x0d, 0x0a):
-                # Consommer un éventuel \n suivant un \r
-                next_byte = self.read_byte(timeout=0.05)
-                if next_byte is not None and next_byte not in (0x0d, 0x0a):
-                    # Remettre le byte dans le buffer? Non, on l'ignore pour simplifier
-                    pass
-                if echo:
-                    self.writeln()
-                return "".join(buffer)
+            consumed = 0
+            done = False
+            echo_out = []
+            for byte in rx:
+                consumed += 1
 
-            # Backspace: 0x08 ou 0x7f
-            if byte in (0x08, 0x7f):
-                if buffer:
-                    buffer.pop()
-                    if echo:
+                # Entrée: \r (0x0d) ou \n (0x0a)
+                if byte in (0x0d, 0x0a):
+                    done = True
+                    break
+
+                # Backspace: 0x08 ou 0x7f
+                if byte in (0x08, 0x7f):
+                    if buffer:
+                        buffer.pop()
                         # Effacer le caractère à l'écran: backspace + espace + backspace
-                        self.write("\x08 \x08")
-                continue
+                        echo_out.append("\x08 \x08")
+                    continue
 
-            # Caractère imprimable
-            if 32 <= byte < 127:
-                char = chr(byte)
-                buffer.append(char)
+                # Caractère imprimable ou étendu latin-1
+                if 32 <= byte < 127 or byte >= 128:
+                    buffer.append(chr(byte))
+                    echo_out.append(chr(byte))
+            del rx[:consumed]
+
+            if echo and echo_out:
+                self.write("".join(echo_out))
+
+            if done:
+                # Consommer un éventuel \n suivant un \r
+                if rx or self._fill_rx(0.05):
+                    if rx[0] in (0x0d, 0x0a):
+                        del rx[0]
                 if echo:
-                    self.write(char)
-            elif byte >= 128:
-                # Caractères étendus latin-1
-                try:
-                    char = bytes([byte]).decode("latin-1")
-                    buffer.append(char)
-                    if echo:
-                        self.write(char)
-                except Exception:
-                    pass
+                    self.writeln()
+                return "".join(buffer)
 
         return "".join(buffer) if buffer else None
 
@@ -481,9 +1079,8 @@ class SimulatedMinitel:
     Implémente la même interface que SerialMinitel.
     """
 
-    def __init__(self, line_delay_ms: int = 0, debug: bool = False):
+    def __init__(self, line_delay_ms: int = 0):
         self.line_delay_ms = line_delay_ms
-        self.debug = debug
         self._pagination_enabled = True
         self._is_open = False
 
@@ -503,11 +1100,21 @@ class SimulatedMinitel:
     def write(self, text: str):
         print(sanitize_latin1(text), end="", flush=True)
 
+    def write_bytes(self, data: bytes):
+        print(data.decode("latin-1"), end="", flush=True)
+
     def writeln(self, line: str = ""):
         print(sanitize_latin1(line))
         if self.line_delay_ms > 0:
             time.sleep(self.line_delay_ms / 1000.0)
 
+    def write_many(self, lines: List[str]):
+        if not lines:
+            return
+        print("\n".join(sanitize_latin1(line) for line in lines))
+        if self.line_delay_ms > 0:
+            time.sleep(len(lines) * self.line_delay_ms / 1000.0)
+
     def clear(self):
         # En mode simulé, on affiche juste des lignes vides
         print("\n" * 5)
@@ -515,6 +1122,13 @@ class SimulatedMinitel:
     def fake_clear(self, lines: int = 24):
         print("\n" * lines)
 
+    def hold_tx(self, enabled: bool):
+        # stdout est déjà bufferisé par Python
+        pass
+
+    def flush_tx(self):
+        sys.stdout.flush()
+
     def read_byte(self, timeout: float = 0.5) -> Optional[int]:
         # En mode simulé, on lit un caractère de stdin
         import select
@@ -618,89 +1232,130 @@ def run_serial_autoconfig(debug: bool = False) -> Optional[Dict[str, Any]]:
     print("-" * 40)
 
     # 3. Test des configurations
+    # Le port n'est ouvert qu'une fois; les paramètres sont changés à chaud.
+    # On affiche d'abord l'écran de test dans chaque configuration, puis on
+    # écoute en tourniquet (tranches courtes) jusqu'à recevoir un 'y'.
     import serial
 
-    for config in SERIAL_CONFIGS:
+    parity_map = {"N": serial.PARITY_NONE, "E": serial.PARITY_EVEN, "O": serial.PARITY_ODD}
+
+    def settings(config: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "baudrate": config["baud"],
+            "bytesize": config["bytesize"],
+            "parity": parity_map.get(config["parity"], serial.PARITY_EVEN),
+            "stopbits": config["stopbits"],
+        }
+
+    try:
+        ser = serial.Serial(port=selected_port, timeout=AUTOCONFIG_SLICE_S,
+                            write_timeout=2, **settings(SERIAL_CONFIGS[0]))
+    except Exception as e:
+        print(f"\nERREUR ouverture: {e}")
+        ser = None
+
+    candidates = []
+    for config in SERIAL_CONFIGS if ser else []:
         label = config["label"]
         print(f"\n[TEST] {label}...", end=" ", flush=True)
 
-        try:
-            parity_map = {"N": serial.PARITY_NONE, "E": serial.PARITY_EVEN, "O": serial.PARITY_ODD}
-            ser = serial.Serial(
-                port=selected_port,
-                baudrate=config["baud"],
-                bytesize=config["bytesize"],
-                parity=parity_map.get(config["parity"], serial.PARITY_EVEN),
-                stopbits=config["stopbits"],
-                timeout=0.5,
-                write_timeout=2
-            )
-        except Exception as e:
-            print(f"ERREUR ouverture: {e}")
-            continue
-
         # Envoyer message de test
         test_msg = f"\r\nTEST {label}\r\n"
         test_msg += "SI TU LIS CECI\r\n"
-        test_msg += "TAPE y PUIS ENTREE\r\n"
+        test_msg += "TAPE y JUSQU'A VALIDATION\r\n"
         test_msg += "> "
 
         try:
+            ser.apply_settings(settings(config))
             ser.write(test_msg.encode("latin-1"))
-            time.sleep(0.1)
+            ser.flush()  # Attendre l'émission complète avant de changer de format
         except Exception as e:
             print(f"ERREUR écriture: {e}")
-            ser.close()
             continue
+        print("envoyé")
+        candidates.append(config)
+
+    def confirm(config: Dict[str, Any]) -> bool:
+        """Réaffiche une invite dans `config` et attend un 'y' de confirmation."""
+        prompt = f"\r\nFORMAT {config['label']}\r\nLISIBLE? TAPE y (SINON n)\r\n> "
+        try:
+            ser.apply_settings(settings(config))
+            ser.reset_input_buffer()
+            ser.write(prompt.encode("latin-1"))
+            ser.flush()
+            deadline = time.monotonic() + AUTOCONFIG_CONFIRM_S
+            while time.monotonic() < deadline:
+                data = ser.read(16)
+                if b"y" in data or b"Y" in data:
+                    return True
+                if b"n" in data or b"N" in data:
+                    return False
+        except Exception:
+            pass
+        return False
 
-        # Attendre réponse 'y'
-        print("En attente de 'y'...", end=" ", flush=True)
-        start_time = time.time()
-        buffer = b""
+    if candidates:
+        print("\nEn attente de 'y'...", end=" ", flush=True)
 
-        while (time.time() - start_time) < 6:  # 6 secondes timeout
+    # Attendre réponse 'y'
+    for _ in range(AUTOCONFIG_ROUNDS):
+        for config in candidates:
             try:
-                data = ser.read(1)
-                if data:
-                    if debug:
-                        print(f"[RX: 0x{data[0]:02x}]", end=" ", flush=True)
-                    buffer += data
-                    # Chercher 'y' ou 'Y' suivi d'un retour
-                    if b"y" in buffer.lower() or b"Y" in buffer:
-                        # Attendre un peu pour le retour ligne
-                        time.sleep(0.3)
-                        extra = ser.read(10)
-                        buffer += extra
-
-                        if any(c in buffer for c in [b"\r", b"\n", b"y", b"Y"]):
-                            print("OK!")
-                            ser.close()
-
-                            # Configuration validée
-                            result = {
-                                "port": selected_port,
-                                "baud": config["baud"],
-                                "bytesize": config["bytesize"],
-                                "parity": config["parity"],
-                                "stopbits": config["stopbits"],
-                                "line_delay_ms": LINE_DELAY_MS,
-                                "char_delay_ms": CHAR_DELAY_MS,
-                                "model": DEFAULT_MODEL,
-                                "page_lines": PAGE_LINES,
-                            }
-
-                            print("\n" + "=" * 40)
-                            print("CONFIGURATION VALIDEE!")
-                            print("=" * 40)
-                            print(f"  Port: {selected_port}")
-                            print(f"  Baud: {config['baud']}")
-                            print(f"  Format: {config['label']}")
-                            print("=" * 40)
-
-                            return result
+                ser.apply_settings(settings(config))
+                # Octets reçus pendant la tranche précédente: décodés avec
+                # un autre format, on les ignore
+                ser.reset_input_buffer()
+                data = ser.read(16)
             except Exception:
-                break
+                continue
+            if not data:
+                continue
+            if debug:
+                print(" ".join(f"[RX {config['label']}: 0x{b:02x}]" for b in data),
+                      end=" ", flush=True)
+            if b"y" not in data and b"Y" not in data:
+                continue
+
+            # Un 'y' tapé en 7E1 se lit aussi 'y' en 7N1 à la même vitesse:
+            # confirmer en repassant par les formats compatibles plus
+            # prioritaires, dans l'ordre de SERIAL_CONFIGS
+            rank = SERIAL_CONFIGS.index(config)
+            checks = [c for c in SERIAL_CONFIGS[:rank + 1]
+                      if c in candidates and c["baud"] == config["baud"]]
+            print(f"'y' reçu en {config['label']}, confirmation...", end=" ", flush=True)
+            confirmed = next((c for c in checks if confirm(c)), None)
+            if confirmed is None:
+                print("non confirmé", end=" ", flush=True)
+                continue
+            config = confirmed
+
+            print("OK!")
+            ser.close()
 
+            # Configuration validée
+            result = {
+                "port": selected_port,
+                "baud": config["baud"],
+                "bytesize": config["bytesize"],
+                "parity": config["parity"],
+                "stopbits": config["stopbits"],
+                "line_delay_ms": LINE_DELAY_MS,
+                "char_delay_ms": CHAR_DELAY_MS,
+                "model": DEFAULT_MODEL,
+                "page_lines": PAGE_LINES,
+            }
+
+            print("\n" + "=" * 40)
+            print("CONFIGURATION VALIDEE!")
+            print("=" * 40)
+            print(f"  Port: {selected_port}")
+            print(f"  Baud: {config['baud']}")
+            print(f"  Format: {config['label']}")
+            print("=" * 40)
+
+            return result
+
+    if ser:
         print("pas de réponse")
         ser.close()
 
@@ -743,145 +1398,130 @@ def run_serial_autoconfig(debug: bool = False) -> Optional[Dict[str, Any]]:
 # Fonctions d'affichage Minitel
 # ============================================================================
 
-def display_wrapped(minitel, text: str, page_lines: int = PAGE_LINES):
-    """Affiche du texte avec wrap à 40 colonnes et pagination."""
-    lines = wrap_40(text, WRAP_COLS)
-    line_count = 0
+# Pagination et bandeau, encodés une fois pour toutes
+_PAGE_PROMPT = "-- suite (touche) --"
+_PAGE_PROMPT_B = _PAGE_PROMPT.encode("latin-1")
+# Efface le message de pagination
+_PAGE_CLEAR = "\r" + " " * 22 + "\r"
+_PAGE_CLEAR_B = _PAGE_CLEAR.encode("latin-1")
+_SEP = "=" * WRAP_COLS
+
 
-    for line in lines:
-        minitel.writeln(line)
-        line_count += 1
+def _emit_lines(minitel, lines: List[str], line_count: int,
+                page_lines: int, pag_enabled: bool) -> int:
+    """
+    Envoie des lignes déjà coupées, par blocs d'une page au plus, avec la
+    pause "-- suite --" à chaque page pleine. Retourne le nouveau compte de
+    lignes de la page en cours. Un `page_lines` <= 0 désactive la pagination.
+    """
+    if not lines:
+        return line_count
+    write_many = minitel.write_many
+    if not pag_enabled or page_lines <= 0:
+        write_many(lines)
+        return line_count + len(lines)
+
+    writeln = minitel.writeln
+    write_bytes = minitel.write_bytes
+    wait = minitel.wait_keypress
+    while lines:
+        room = page_lines - line_count
+        batch, lines = lines[:room], lines[room:]
+        write_many(batch)
+        line_count += len(batch)
 
         # Pagination
-        if minitel.is_pagination_enabled() and line_count >= page_lines:
-            minitel.writeln()
-            minitel.write("-- suite (touche) --")
-            minitel.wait_keypress(timeout=300)
+        if line_count >= page_lines:
+            writeln()
+            write_bytes(_PAGE_PROMPT_B)
+            wait(timeout=300)
             # Effacer le message "suite"
-            minitel.write("\r" + " " * 22 + "\r")
+            write_bytes(_PAGE_CLEAR_B)
             line_count = 0
+    return line_count
+
+
+def display_wrapped(minitel, text: str, page_lines: int = PAGE_LINES):
+    """Affiche du texte avec wrap à 40 colonnes et pagination."""
+    # Substitutions typographiques avant le wrap ("…" -> "..."), pour que les
+    # longueurs mesurées soient celles envoyées au Minitel
+    text = text.translate(_LATIN1_FIXUP)
+    lines = [line for line in wrap_text(text, WRAP_COLS) if not _FENCE_RE.match(line)]
+    # Sans pagination, tout part en un seul envoi
+    _emit_lines(minitel, lines, 0, page_lines, minitel.is_pagination_enabled())
 
 
 def display_streaming(minitel, text_generator: Generator[str, None, None],
                       page_lines: int = PAGE_LINES) -> str:
     """
     Affiche du texte en streaming avec wrap progressif.
-    Accumule dans un buffer et flush ligne par ligne.
+    Les lignes sont envoyées dès qu'elles sont complètes (LineWrapper),
+    groupées par morceau reçu.
+    Le générateur est consommé par un thread: la lecture réseau continue
+    pendant que la liaison série (lente) envoie les lignes précédentes.
     Retourne le texte complet.
     """
-    full_text = ""
-    buffer = ""
-    line_count = 0
-    current_line_len = 0
-
-    for chunk in text_generator:
-        full_text += chunk
-        buffer += chunk
-
-        # Traiter le buffer caractère par caractère
-        while buffer:
-            # Chercher un point de coupure naturel
-            if "\n" in buffer:
-                idx = buffer.index("\n")
-                segment = buffer[:idx]
-                buffer = buffer[idx + 1:]
-
-                # Afficher le segment avec wrap
-                if current_line_len + len(segment) <= WRAP_COLS:
-                    minitel.write(segment)
-                    current_line_len += len(segment)
-                else:
-                    # Wrap nécessaire
-                    remaining = segment
-                    while remaining:
-                        space_left = WRAP_COLS - current_line_len
-                        if len(remaining) <= space_left:
-                            minitel.write(remaining)
-                            current_line_len += len(remaining)
-                            break
-                        else:
-                            # Trouver le dernier espace dans la zone disponible
-                            cut_point = remaining[:space_left].rfind(" ")
-                            if cut_point <= 0:
-                                cut_point = space_left
-                            minitel.write(remaining[:cut_point])
-                            minitel.writeln()
-                            line_count += 1
-                            remaining = remaining[cut_point:].lstrip()
-                            current_line_len = 0
-
-                            # Pagination
-                            if minitel.is_pagination_enabled() and line_count >= page_lines:
-                                minitel.writeln()
-                                minitel.write("-- suite (touche) --")
-                                minitel.wait_keypress(timeout=300)
-                                minitel.write("\r" + " " * 22 + "\r")
-                                line_count = 0
-
-                # Nouvelle ligne
-                minitel.writeln()
-                line_count += 1
-                current_line_len = 0
-
-                # Pagination
-                if minitel.is_pagination_enabled() and line_count >= page_lines:
-                    minitel.writeln()
-                    minitel.write("-- suite (touche) --")
-                    minitel.wait_keypress(timeout=300)
-                    minitel.write("\r" + " " * 22 + "\r")
-                    line_count = 0
-
-            elif " " in buffer and len(buffer) > 10:
-                # On a assez de texte avec un espace, on peut afficher
-                idx = buffer.rfind(" ")
-                segment = buffer[:idx]
-                buffer = buffer[idx + 1:]
-
-                # Wrap si nécessaire
-                while segment:
-                    space_left = WRAP_COLS - current_line_len
-                    if len(segment) <= space_left:
-                        minitel.write(segment + " ")
-                        current_line_len += len(segment) + 1
+    chunks: "queue.Queue" = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def producer():
+        # (morceau, None) puis (None, None) en fin de flux, ou (None, exc)
+        try:
+            for chunk in text_generator:
+                while not stop.is_set():
+                    try:
+                        chunks.put((chunk, None), timeout=0.5)
                         break
-                    else:
-                        cut_point = segment[:space_left].rfind(" ")
-                        if cut_point <= 0:
-                            cut_point = space_left
-                        minitel.write(segment[:cut_point])
-                        minitel.writeln()
-                        line_count += 1
-                        segment = segment[cut_point:].lstrip()
-                        current_line_len = 0
-
-                        if minitel.is_pagination_enabled() and line_count >= page_lines:
-                            minitel.writeln()
-                            minitel.write("-- suite (touche) --")
-                            minitel.wait_keypress(timeout=300)
-                            minitel.write("\r" + " " * 22 + "\r")
-                            line_count = 0
-            else:
-                # Pas assez de texte, attendre plus
-                break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            item = (None, None)
+        except Exception as e:
+            item = (None, e)
+        # L'affichage attend ce dernier élément: il a toujours sa place
+        # une fois les morceaux précédents consommés
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    parts = []
+    wrapper = LineWrapper(WRAP_COLS)
+    feed = wrapper.feed
+    flush_tx = minitel.flush_tx
+    # /nopage ne peut pas changer pendant l'affichage
+    pag_enabled = minitel.is_pagination_enabled()
+    line_count = 0
 
-    # Flush le reste du buffer
-    if buffer:
-        while buffer:
-            space_left = WRAP_COLS - current_line_len
-            if len(buffer) <= space_left:
-                minitel.write(buffer)
+    # Envois regroupés; le tampon est vidé avant d'attendre le morceau suivant
+    minitel.hold_tx(True)
+    threading.Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            chunk, error = chunks.get()
+            if chunk is None:
+                if error is not None:
+                    raise error
                 break
-            else:
-                cut_point = buffer[:space_left].rfind(" ")
-                if cut_point <= 0:
-                    cut_point = space_left
-                minitel.write(buffer[:cut_point])
-                minitel.writeln()
-                buffer = buffer[cut_point:].lstrip()
-                current_line_len = 0
+            parts.append(chunk)
+            # Les lignes terminées par un même morceau partent en un seul envoi
+            # Substitutions avant le wrap, comme display_wrapped
+            line_count = _emit_lines(minitel, feed(chunk.translate(_LATIN1_FIXUP)),
+                                     line_count, page_lines, pag_enabled)
+            # D'autres morceaux déjà arrivés: ils rejoignent le même envoi
+            if chunks.empty():
+                flush_tx()
 
-    minitel.writeln()
-    return full_text
+        # Flush la dernière ligne
+        _emit_lines(minitel, wrapper.flush(), line_count, page_lines, pag_enabled)
+    finally:
+        stop.set()
+        minitel.hold_tx(False)
+
+    return "".join(parts)
 
 
 # ============================================================================
@@ -889,16 +1529,15 @@ def display_streaming(minitel, text_generator: Generator[str, None, None],
 # ============================================================================
 
 def load_system_prompt() -> str:
-    """Charge le prompt système depuis system_profile.txt ou utilise le défaut."""
-    profile_path = Path(SYSTEM_PROFILE_FILE)
-    if profile_path.exists():
-        try:
-            content = profile_path.read_text(encoding="utf-8").strip()
-            if content:
-                return content
-        except IOError:
-            pass
-    return DEFAULT_SYSTEM_PROMPT
+    """
+    Charge le prompt système depuis system_profile.txt ou utilise le défaut.
+    Le fichier n'est relu que s'il a changé (cache sur le mtime).
+    """
+    try:
+        content = load_text_cached(SYSTEM_PROFILE_FILE).strip()
+    except (OSError, UnicodeDecodeError):
+        return DEFAULT_SYSTEM_PROMPT
+    return content or DEFAULT_SYSTEM_PROMPT
 
 
 # ============================================================================
@@ -922,22 +1561,135 @@ def show_help(minitel):
     display_wrapped(minitel, help_text)
 
 
+class ShellState:
+    """État du shell partagé entre la boucle principale et les commandes."""
+
+    def __init__(self, config: ConfigStore, history: HistoryStore,
+                 system_prompt: str, debug: bool = False):
+        self.config = config
+        self.history = history
+        self.model = config.get("model", DEFAULT_MODEL)
+        # Une valeur <= 0 dans minitel_config.json bloquerait la pagination
+        try:
+            self.page_lines = max(1, int(config.get("page_lines", PAGE_LINES)))
+        except (TypeError, ValueError):
+            self.page_lines = PAGE_LINES
+        self.debug_rx = debug
+        # Messages envoyés à l'API: prompt système + historique, tenus à jour
+        # tour après tour plutôt que reconstruits à chaque requête
+        self.messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt}]
+        self.messages.extend(history.get_messages())
+        self.last_save = time.monotonic()
+
+
+def _cmd_help(minitel, arg: str, state: ShellState) -> Optional[str]:
+    show_help(minitel)
+    return None
+
+
+def _cmd_clear(minitel, arg: str, state: ShellState) -> Optional[str]:
+    minitel.clear()
+    time.sleep(0.1)
+    # Si le clear ne marche pas, faire un faux clear
+    # (l'utilisateur peut relancer /clear si besoin)
+    return None
+
+
+def _cmd_quit(minitel, arg: str, state: ShellState) -> Optional[str]:
+    minitel.writeln("Au revoir!")
+    state.history.save()
+    return "quit"
+
+
+def _cmd_reset(minitel, arg: str, state: ShellState) -> Optional[str]:
+    minitel.writeln("Relance config serie...")
+    return "reset"  # Signal pour relancer l'autoconfig
+
+
+def _cmd_model(minitel, arg: str, state: ShellState) -> Optional[str]:
+    if arg:
+        state.model = arg.strip()
+        state.config.set("model", state.model)
+        state.config.save()
+        minitel.writeln(f"Modele: {state.model}")
+    else:
+        minitel.writeln(f"Modele actuel: {state.model}")
+    return None
+
+
+def _cmd_debug(minitel, arg: str, state: ShellState) -> Optional[str]:
+    state.debug_rx = not state.debug_rx
+    if state.debug_rx:
+        minitel.writeln("Debug RX actif")
+        print("[DEBUG] Mode debug RX activé - les octets seront affichés en console",
+              file=sys.stderr)
+    else:
+        minitel.writeln("Debug RX desactive")
+    set_debug_logging(state.debug_rx)
+    return None
+
+
+def _cmd_history_reset(minitel, arg: str, state: ShellState) -> Optional[str]:
+    state.history.reset()
+    del state.messages[1:]
+    minitel.writeln("Historique efface")
+    return None
+
+
+def _cmd_nopage(minitel, arg: str, state: ShellState) -> Optional[str]:
+    current = minitel.is_pagination_enabled()
+    minitel.set_pagination(not current)
+    if minitel.is_pagination_enabled():
+        minitel.writeln("Pagination activee")
+    else:
+        minitel.writeln("Pagination desactivee")
+    return None
+
+
+def _cmd_throttle(minitel, arg: str, state: ShellState) -> Optional[str]:
+    if arg:
+        try:
+            ms = int(arg)
+            minitel.line_delay_ms = ms
+            state.config.set("line_delay_ms", ms)
+            state.config.save()
+            minitel.writeln(f"Delai: {ms}ms")
+        except ValueError:
+            minitel.writeln("Usage: /throttle <ms>")
+    else:
+        minitel.writeln(f"Delai actuel: {minitel.line_delay_ms}ms")
+    return None
+
+
+# Commandes locales: nom -> handler(minitel, arg, state).
+# Un handler renvoie "quit"/"reset" pour sortir du shell, None sinon.
+COMMANDS = {
+    "/help": _cmd_help,
+    "/clear": _cmd_clear,
+    "/quit": _cmd_quit,
+    "/reset": _cmd_reset,
+    "/model": _cmd_model,
+    "/debug": _cmd_debug,
+    "/history_reset": _cmd_history_reset,
+    "/nopage": _cmd_nopage,
+    "/throttle": _cmd_throttle,
+}
+
+
 def run_shell(minitel, openai_client: OpenAIClientWrapper,
               config: ConfigStore, history: HistoryStore,
               debug: bool = False, stream: bool = True):
     """Boucle principale du shell Minitel."""
 
-    model = config.get("model", DEFAULT_MODEL)
-    page_lines = config.get("page_lines", PAGE_LINES)
-    system_prompt = load_system_prompt()
-    debug_rx = debug
+    state = ShellState(config, history, load_system_prompt(), debug)
+    messages = state.messages
 
     minitel.clear()
     time.sleep(0.2)
-    minitel.writeln("=" * 40)
+    minitel.writeln(_SEP)
     minitel.writeln("  MINITEL-GPT")
     minitel.writeln("  Tape /help pour les commandes")
-    minitel.writeln("=" * 40)
+    minitel.writeln(_SEP)
     minitel.writeln()
 
     while True:
@@ -954,108 +1706,60 @@ def run_shell(minitel, openai_client: OpenAIClientWrapper,
                 continue
 
             # Commandes locales
-            if user_input.startswith("/"):
-                cmd_parts = user_input.split(maxsplit=1)
-                cmd = cmd_parts[0].lower()
-                arg = cmd_parts[1] if len(cmd_parts) > 1 else ""
-
-                if cmd == "/help":
-                    show_help(minitel)
-
-                elif cmd == "/clear":
-                    minitel.clear()
-                    time.sleep(0.1)
-                    # Si le clear ne marche pas, faire un faux clear
-                    # (l'utilisateur peut relancer /clear si besoin)
-
-                elif cmd == "/quit":
-                    minitel.writeln("Au revoir!")
-                    break
-
-                elif cmd == "/reset":
-                    minitel.writeln("Relance config serie...")
-                    return "reset"  # Signal pour relancer l'autoconfig
-
-                elif cmd == "/model":
-                    if arg:
-                        model = arg.strip()
-                        config.set("model", model)
-                        config.save()
-                        minitel.writeln(f"Modele: {model}")
-                    else:
-                        minitel.writeln(f"Modele actuel: {model}")
-
-                elif cmd == "/debug":
-                    debug_rx = not debug_rx
-                    if debug_rx:
-                        minitel.writeln("Debug RX actif")
-                        print("[DEBUG] Mode debug RX activé - les octets seront affichés en console",
-                              file=sys.stderr)
-                    else:
-                        minitel.writeln("Debug RX desactive")
-                    if hasattr(minitel, "debug"):
-                        minitel.debug = debug_rx
-
-                elif cmd == "/history_reset":
-                    history.reset()
-                    minitel.writeln("Historique efface")
-
-                elif cmd == "/nopage":
-                    current = minitel.is_pagination_enabled()
-                    minitel.set_pagination(not current)
-                    if minitel.is_pagination_enabled():
-                        minitel.writeln("Pagination activee")
-                    else:
-                        minitel.writeln("Pagination desactivee")
-
-                elif cmd == "/throttle":
-                    if arg:
-                        try:
-                            ms = int(arg)
-                            minitel.line_delay_ms = ms
-                            config.set("line_delay_ms", ms)
-                            config.save()
-                            minitel.writeln(f"Delai: {ms}ms")
-                        except ValueError:
-                            minitel.writeln("Usage: /throttle <ms>")
-                    else:
-                        minitel.writeln(f"Delai actuel: {minitel.line_delay_ms}ms")
-
-                else:
+            if user_input[:1] == "/":
+                sp = user_input.find(" ")
+                cmd = user_input if sp < 0 else user_input[:sp]
+                arg = "" if sp < 0 else user_input[sp + 1:].strip()
+
+                # Les commandes sont en minuscules; .lower() seulement si la
+                # saisie ne correspond pas telle quelle (clavier en majuscules)
+                handler = COMMANDS.get(cmd) or COMMANDS.get(cmd.lower())
+                if handler is None:
                     minitel.writeln(f"Commande inconnue: {cmd}")
-
+                    continue
+                signal = handler(minitel, arg, state)
+                if signal:
+                    return signal  # "quit" ou "reset" (relancer l'autoconfig)
                 continue
 
             # Envoi à OpenAI
             minitel.writeln()
 
-            # Construire les messages
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend(history.get_messages())
             messages.append({"role": "user", "content": user_input})
 
             try:
                 if stream:
                     response_text = display_streaming(
                         minitel,
-                        openai_client.call(messages, model=model, stream=True),
-                        page_lines=page_lines
+                        openai_client.call(messages, model=state.model, stream=True),
+                        page_lines=state.page_lines
                     )
                 else:
-                    response_text = ""
-                    for chunk in openai_client.call(messages, model=model, stream=False):
-                        response_text += chunk
-                    display_wrapped(minitel, response_text, page_lines=page_lines)
+                    response_text = "".join(
+                        openai_client.call(messages, model=state.model, stream=False))
+                    display_wrapped(minitel, response_text, page_lines=state.page_lines)
 
                 # Sauvegarder dans l'historique
+                messages.append({"role": "assistant", "content": response_text})
                 history.add("user", user_input)
                 history.add("assistant", response_text)
-                history.save()
+                # Les messages sont déjà sur disque (add); save() peut compacter
+                # le fichier, on ne le fait pas à chaque tour
+                now = time.monotonic()
+                if now - state.last_save > SAVE_INTERVAL:
+                    history.save()
+                    state.last_save = now
+                # Répercuter le trim de l'historique (messages les plus anciens)
+                excess = len(messages) - 1 - len(history.messages)
+                if excess > 0:
+                    del messages[1:1 + excess]
 
             except Exception as e:
+                if messages[-1]["role"] == "user":
+                    messages.pop()
                 minitel.writeln()
                 minitel.writeln("Erreur API. Reessaie.")
-                if debug_rx:
+                if state.debug_rx:
                     print(f"[ERREUR] {type(e).__name__}: {e}", file=sys.stderr)
 
             minitel.writeln()
@@ -1063,6 +1767,7 @@ def run_shell(minitel, openai_client: OpenAIClientWrapper,
         except KeyboardInterrupt:
             minitel.writeln()
             minitel.writeln("Ctrl+C detecte.")
+            history.save()
             break
 
     return "quit"
@@ -1085,17 +1790,19 @@ def main():
     parser.add_argument("--no-stream", action="store_true",
                         help="Désactiver le streaming (récupère la réponse complète)")
     args = parser.parse_args()
+    set_debug_logging(args.debug)
 
     # Initialiser les stores
     config = ConfigStore()
     history = HistoryStore()
+    atexit.register(history.save)
 
     # Charger l'historique
     history.load()
 
     # Initialiser le client OpenAI
     try:
-        openai_client = OpenAIClientWrapper(debug=args.debug)
+        openai_client = OpenAIClientWrapper()
     except Exception as e:
         print(f"[ERREUR] Impossible d'initialiser OpenAI: {e}", file=sys.stderr)
         print("\nVérifiez que OPENAI_API_KEY est défini:", file=sys.stderr)
@@ -1110,7 +1817,7 @@ def main():
         print("=" * 50)
         print()
 
-        minitel = SimulatedMinitel(debug=args.debug)
+        minitel = SimulatedMinitel()
         minitel.open()
 
         # Créer une config par défaut pour le mode simulation
@@ -1175,8 +1882,7 @@ def main():
             parity=config.get("parity", "E"),
             stopbits=config.get("stopbits", 1),
             line_delay_ms=config.get("line_delay_ms", LINE_DELAY_MS),
-            char_delay_ms=config.get("char_delay_ms", CHAR_DELAY_MS),
-            debug=args.debug
+            char_delay_ms=config.get("char_delay_ms", CHAR_DELAY_MS)
         )
 
         if not minitel.open():
@@ -0,0 +1,317 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import minitel_gpt  # noqa: E402
+
+
+class FakeMinitel:
+    """Minitel factice: enregistre les lignes affichées."""
+
+    def __init__(self, pagination: bool = False):
+        self.lines = []
+        self.pagination = pagination
+
+    def write(self, text):
+        pass
+
+    def write_bytes(self, data):
+        pass
+
+    def writeln(self, line=""):
+        self.lines.append(line)
+
+    def write_many(self, lines):
+        self.lines.extend(lines)
+
+    def wait_keypress(self, timeout=300.0):
+        return 13
+
+    def is_pagination_enabled(self):
+        return self.pagination
+
+    def hold_tx(self, enabled):
+        pass
+
+    def flush_tx(self):
+        pass
+
+
+def chunked(text, size):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+def wrap_stream(text, sizes, width=minitel_gpt.WRAP_COLS):
+    wrapper = minitel_gpt.LineWrapper(width)
+    lines = []
+    i = 0
+    rng = random.Random(len(text))
+    while i < len(text):
+        n = rng.choice(sizes)
+        lines += wrapper.feed(text[i:i + n])
+        i += n
+    return lines + wrapper.flush()
+
+
+SAMPLES = [
+    "",
+    "abc",
+    "\n\nabc\n\n",
+    "Voici un exemple:\n    def f(x):\n        return x\nFin.",
+    "mot  deux   espaces    et une ligne qui depasse largement les quarante colonnes",
+    "x" * 95 + " fin",
+    "   " + "y" * 50,
+    "```python\nprint('ok')\n```\n",
+    "ligne avec espaces de fin    \nsuite",
+]
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+@pytest.mark.parametrize("size", [1, 3, 7, 64])
+def test_line_wrapper_matches_wrap_40(text, size):
+    expected = [line for line in minitel_gpt.wrap_40(text)
+                if not minitel_gpt._FENCE_RE.match(line)]
+    assert wrap_stream(text, [size]) == expected
+
+
+def test_line_wrapper_matches_wrap_40_random():
+    rng = random.Random(0)
+    tokens = ["a", "bb", "x" * 20, "y" * 39, "z" * 41, "w" * 90,
+              " ", "  ", "   ", "\n", "é"]
+    for _ in range(2000):
+        text = "".join(rng.choice(tokens) for _ in range(rng.randint(0, 40)))
+        expected = minitel_gpt.wrap_40(text)
+        assert wrap_stream(text, [1, 2, 5, 17]) == expected, repr(text)
+
+
+def test_line_wrapper_keeps_indentation():
+    text = "Voici un exemple:\n    def f(x):\n        return x\nFin."
+    assert wrap_stream(text, [7]) == [
+        "Voici un exemple:", "    def f(x):", "        return x", "Fin."]
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+@pytest.mark.parametrize("pagination", [False, True])
+def test_display_wrapped_and_streaming_agree(text, pagination):
+    wrapped = FakeMinitel(pagination)
+    minitel_gpt.display_wrapped(wrapped, text, page_lines=3)
+    streamed = FakeMinitel(pagination)
+    result = minitel_gpt.display_streaming(streamed, chunked(text, 7), page_lines=3)
+    assert result == text
+    assert streamed.lines == wrapped.lines
+
+
+def test_history_add_and_reload(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = minitel_gpt.HistoryStore(str(path))
+    store.load()
+    store.add("user", "Très bien")
+    store.add("assistant", "Merci")
+    reloaded = minitel_gpt.HistoryStore(str(path))
+    reloaded.load()
+    assert reloaded.messages == [
+        {"role": "user", "content": "Très bien"},
+        {"role": "assistant", "content": "Merci"},
+    ]
+
+
+@pytest.mark.parametrize("loads", ["json", "default"])
+def test_history_load_skips_truncated_tail(tmp_path, monkeypatch, loads):
+    if loads == "json":
+        monkeypatch.setattr(minitel_gpt, "_loads", minitel_gpt.json.loads)
+    path = tmp_path / "history.jsonl"
+    store = minitel_gpt.HistoryStore(str(path))
+    store.add("user", "Bonjour")
+    store.add("assistant", "Très bien")
+    # Arrêt brutal au milieu du caractère "è"
+    data = path.read_bytes()
+    path.write_bytes(data[:data.index(b"Tr\xc3") + 3])
+
+    store = minitel_gpt.HistoryStore(str(path))
+    store.load()
+    assert store.messages == [{"role": "user", "content": "Bonjour"}]
+    # La ligne tronquée est retirée du fichier par le compactage
+    assert path.read_bytes().count(b"\n") == 1
+
+
+def test_history_load_compacts_trimmed_messages(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = minitel_gpt.HistoryStore(str(path), max_turns=1)
+    for i in range(4):
+        store.add("user", f"q{i}")
+    assert path.read_bytes().count(b"\n") == 4
+
+    store = minitel_gpt.HistoryStore(str(path), max_turns=1)
+    store.load()
+    assert [m["content"] for m in store.messages] == ["q2", "q3"]
+    assert path.read_bytes().count(b"\n") == 2
+
+
+def test_history_read_error_keeps_file(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "history.jsonl"
+    store = minitel_gpt.HistoryStore(str(path))
+    store.add("user", "Bonjour")
+    before = path.read_bytes()
+
+    def fail(self):
+        raise OSError("disque indisponible")
+
+    monkeypatch.setattr(type(path), "read_bytes", fail)
+    store = minitel_gpt.HistoryStore(str(path))
+    store.load()
+    monkeypatch.undo()
+
+    assert store.messages == []
+    assert path.read_bytes() == before
+    assert "Erreur lecture historique" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_typographic_expansion_fits_width(stream):
+    text = "a" * 38 + "… suite " + "b" * 30 + "…"
+    minitel = FakeMinitel()
+    if stream:
+        minitel_gpt.display_streaming(minitel, chunked(text, 5))
+    else:
+        minitel_gpt.display_wrapped(minitel, text)
+    encoded = [minitel_gpt._to_latin1_bytes(line) for line in minitel.lines]
+    assert all(len(line) <= minitel_gpt.WRAP_COLS for line in encoded)
+    assert b"".join(encoded).count(b"...") == 2
+
+
+@pytest.mark.parametrize("page_lines", [0, -3])
+def test_emit_lines_invalid_page_size_disables_pagination(page_lines):
+    minitel = FakeMinitel(pagination=True)
+    minitel_gpt.display_wrapped(minitel, "a\nb\nc", page_lines=page_lines)
+    assert minitel.lines == ["a", "b", "c"]
+
+
+SSE_STREAM = (
+    'data: {"choices": [{"delta": {"content": "Très"}}]}\r\n\r\n'
+    'data: {"choices": [{"delta": {"content": " bien"}}]}\r\n\r\n'
+    "data: [DONE]\r\n\r\n"
+)
+SSE_EVENTS = [
+    {"choices": [{"delta": {"content": "Très"}}]},
+    {"choices": [{"delta": {"content": " bien"}}]},
+]
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 13, 1000])
+def test_sse_split_bytes_chunks(size):
+    raw = SSE_STREAM.encode("utf-8")
+    chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+    assert list(minitel_gpt.sse_split(chunks)) == SSE_EVENTS
+
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_sse_split_str_chunks(size):
+    assert list(minitel_gpt.sse_split(chunked(SSE_STREAM, size))) == SSE_EVENTS
+
+
+def test_sse_split_passes_decoded_objects_through():
+    event = {"choices": []}
+    assert list(minitel_gpt.sse_split([event])) == [event]
+
+
+def test_history_migrates_legacy_file(tmp_path):
+    path = tmp_path / "history.jsonl"
+    legacy = tmp_path / "history.json"
+    legacy.write_text('[{"role": "user", "content": "ancien"}]', encoding="utf-8")
+    store = minitel_gpt.HistoryStore(str(path))
+    store.load()
+    assert store.messages == [{"role": "user", "content": "ancien"}]
+    assert path.exists()
+    assert not legacy.exists()
+
+
+def test_history_reset_then_reload_with_legacy_file(tmp_path):
+    path = tmp_path / "history.jsonl"
+    legacy = tmp_path / "history.json"
+    legacy.write_text('[{"role": "user", "content": "old secret"}]', encoding="utf-8")
+    store = minitel_gpt.HistoryStore(str(path))
+    store.load()
+    # Ancien fichier réapparu (copie, sauvegarde...): reset doit l'effacer aussi
+    legacy.write_text('[{"role": "user", "content": "old secret"}]', encoding="utf-8")
+    store.reset()
+
+    reloaded = minitel_gpt.HistoryStore(str(path))
+    reloaded.load()
+    assert reloaded.messages == []
+
+
+def test_sse_split_keeps_unicode_line_separators_in_json():
+    event = {"choices": [{"delta": {"content": "a\u2028b\u2029c\x0bd\x0ce\x1cf\x85g"}}]}
+    raw = "data: " + minitel_gpt.json.dumps(event, ensure_ascii=False) + "\n\n"
+    assert list(minitel_gpt.sse_split([raw])) == [event]
+    assert list(minitel_gpt.sse_split([raw.encode("utf-8")])) == [event]
+
+
+@pytest.mark.parametrize("tail", ["", "\n", "\r\n"])
+def test_sse_split_parses_last_event_without_blank_line(tail):
+    raw = 'data: {"x": 0}\n\ndata: {"x": 1}' + tail
+    assert list(minitel_gpt.sse_split(chunked(raw, 4))) == [{"x": 0}, {"x": 1}]
+
+
+class FakeSerial:
+    """Port série factice: enregistre chaque write()."""
+
+    is_open = True
+    out_waiting = 20
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+        return len(data)
+
+
+def test_held_tx_batches_lines_with_one_capped_pause(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(minitel_gpt.time, "sleep", sleeps.append)
+    minitel = minitel_gpt.SerialMinitel("x", line_delay_ms=80)
+    minitel.serial = FakeSerial()
+
+    minitel.hold_tx(True)
+    minitel.write_many(["a", "b", "c"])
+    minitel.writeln("d")
+    assert minitel.serial.writes == []
+    minitel.hold_tx(False)
+
+    # Un seul envoi, une seule pause plafonnée au temps de vidage de l'UART
+    assert minitel.serial.writes == [b"a\r\nb\r\nc\r\nd\r\n"]
+    assert sleeps == [pytest.approx(20 * minitel._bit_time)]
+
+
+def wrap_offsets_lines(text, width=minitel_gpt.WRAP_COLS):
+    np = minitel_gpt.np
+    buf = np.frombuffer(text.encode("latin-1", errors="replace"), dtype=np.uint8)
+    offsets = minitel_gpt._wrap_offsets(buf, width)
+    return [text[offsets[k]:offsets[k + 1]] for k in range(0, len(offsets), 2)]
+
+
+@pytest.fixture
+def numpy_kernel(monkeypatch):
+    # Le noyau tourne en Python pur (sans numba) dès que numpy est présent
+    numpy = pytest.importorskip("numpy")
+    monkeypatch.setattr(minitel_gpt, "np", numpy)
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_wrap_offsets_matches_wrap_40(numpy_kernel, text):
+    assert wrap_offsets_lines(text) == minitel_gpt.wrap_40(text)
+
+
+def test_wrap_offsets_matches_wrap_40_random(numpy_kernel):
+    rng = random.Random(1)
+    tokens = ["a", "bb", "x" * 20, "y" * 39, "y" * 40, "z" * 41, "w" * 90,
+              " ", "  ", "   ", "\n", "é", "€"]
+    for _ in range(2000):
+        text = "".join(rng.choice(tokens) for _ in range(rng.randint(0, 40)))
+        assert wrap_offsets_lines(text) == minitel_gpt.wrap_40(text), repr(text)
+        assert wrap_offsets_lines(text, 10) == minitel_gpt.wrap_40(text, 10), repr(text)